@@ -1,54 +1,253 @@
 # app.py - FINAL VERSION WITH CORRECT RESPONSE FORMATTING
 import os
-import json
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import orjson
 import psycopg2
-from flask import Flask, request, jsonify, Response
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+import click
+from cachetools import TTLCache
+from flask import Flask, request, Response
 from functools import wraps
 
 app = Flask(__name__)
 
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
+log = logging.getLogger(__name__)
+
 # --- DATABASE SETUP ---
 DATABASE_URL = os.environ.get('DATABASE_URL')
 ISSUER_ID = os.environ.get('ISSUER_ID')
 ISSUER_SECRET = os.environ.get('ISSUER_SECRET')
 
+# "editions" is a JSONB column; psycopg2 hands it back as a dict, parsed with orjson.
+psycopg2.extras.register_default_jsonb(globally=True, loads=orjson.loads)
+
+# Server-side prepared statements for the hot queries, so PostgreSQL parses and plans them
+# once per connection instead of once per request. Bump the suffix when changing a statement.
+# Expiration dates come back as whole Unix seconds (exp_epoch), the form Cloud Zoo expects.
+PREPARED_STATEMENTS = {
+    "get_license_v2": '''
+        PREPARE get_license_v2 (varchar, varchar) AS
+        SELECT license_key, product_id, "numberOfSeats",
+               trunc(EXTRACT(EPOCH FROM "exp"))::bigint AS exp_epoch, "editions"
+        FROM licenses WHERE license_key = $1 AND product_id = $2;
+    ''',
+    # Locks the license row, assigns it if it was available, and reports the status it had
+    # before, all in one round trip. No row back means the key doesn't exist.
+    "assign_license_v3": '''
+        PREPARE assign_license_v3 (varchar, varchar, varchar) AS
+        WITH existing AS (
+            SELECT license_key, status, "numberOfSeats", "exp", "editions"
+            FROM licenses WHERE license_key = $2 AND product_id = $3
+            FOR UPDATE
+        ), assigned AS (
+            UPDATE licenses
+            SET status = 'assigned', entity_id = $1, date_assigned = NOW()
+            FROM existing
+            WHERE licenses.license_key = existing.license_key AND existing.status = 'available'
+            RETURNING 1
+        )
+        SELECT status AS prior_status, "numberOfSeats",
+               trunc(EXTRACT(EPOCH FROM "exp"))::bigint AS exp_epoch, "editions",
+               EXISTS (SELECT 1 FROM assigned) AS assigned
+        FROM existing;
+    ''',
+    "release_licenses_v1": '''
+        PREPARE release_licenses_v1 (varchar[]) AS
+        UPDATE licenses
+        SET status = 'available', entity_id = NULL, date_assigned = NULL
+        WHERE license_key = ANY($1);
+    ''',
+}
+
+# Assigns a whole cluster of licenses in one statement; execute_values() expands the VALUES
+# list. Not prepared, since the number of rows varies per request.
+ASSIGN_LICENSE_CLUSTER_SQL = '''
+    UPDATE licenses
+    SET status = 'assigned', entity_id = data.entity_id, date_assigned = NOW()
+    FROM (VALUES %s) AS data (entity_id, license_key, product_id)
+    WHERE licenses.license_key = data.license_key AND licenses.product_id = data.product_id
+        AND licenses.status = 'available'
+    RETURNING licenses.license_key, licenses.product_id, "numberOfSeats",
+        trunc(EXTRACT(EPOCH FROM licenses."exp"))::bigint AS exp_epoch, "editions";
+'''
+
+class PreparedConnection(psycopg2.extensions.connection):
+    """A connection that remembers whether PREPARED_STATEMENTS have been set up on it,
+    and when it was last handed back to the pool."""
+    prepared = False
+    released_at = None
+
+class RetainingConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """A ThreadedConnectionPool that keeps every returned connection open for reuse.
+
+    psycopg2's pool only keeps `minconn` idle connections and closes any others as they come
+    back, so concurrent requests beyond `minconn` would reconnect every time. Here `minconn`
+    connections are opened up front and up to `maxconn` are kept once opened.
+    """
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # putconn() only consults minconn to decide whether to keep a connection.
+        self.minconn = maxconn
+
+# Connections are opened once and reused across requests instead of paying the
+# connect/auth handshake on every call. TCP keepalives stop the network between the app and
+# PostgreSQL from silently dropping idle pooled connections, and detect the ones that do die.
+# The pool is created on first use, so importing the app (gunicorn boot, flask CLI) doesn't
+# need the database to be up.
+POOL = None
+POOL_LOCK = threading.Lock()
+
+def get_pool():
+    """Returns the connection pool, creating it on the first call."""
+    global POOL
+    if POOL is None:
+        with POOL_LOCK:
+            if POOL is None:
+                POOL = RetainingConnectionPool(
+                    2, 20, dsn=DATABASE_URL, connection_factory=PreparedConnection,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3,
+                    tcp_user_timeout=15000,
+                )
+    return POOL
+
+# A connection idle for longer than this is pinged before use, in case it died while idle.
+PING_AFTER_IDLE_SECONDS = 30
+
+def prepare_statements(conn):
+    """Runs PREPARE for each hot query. Needed once per physical connection, which the pool
+    keeps open for reuse."""
+    with conn, conn.cursor() as cur:
+        # All of them in one round trip, plus the COMMIT.
+        cur.execute(''.join(PREPARED_STATEMENTS.values()))
+    conn.prepared = True
+
+def is_alive(conn):
+    """Runs a trivial query to check that a connection that sat idle still works."""
+    if conn.released_at is None or time.monotonic() - conn.released_at < PING_AFTER_IDLE_SECONDS:
+        return True
+    try:
+        # The ping's transaction is left open; the caller's own work commits or rolls it back.
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1;')
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
 def get_db_connection():
-    """Creates a database connection."""
-    conn = psycopg2.connect(DATABASE_URL)
+    """Checks a working database connection out of the pool, ready to EXECUTE the prepared statements."""
+    pool = get_pool()
+    conn = pool.getconn()
+    # Dead connections are closed and replaced, at most once per pool slot.
+    for _ in range(pool.maxconn):
+        if is_alive(conn):
+            break
+        log.warning("Discarding a dead database connection.")
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    if not conn.prepared:
+        try:
+            prepare_statements(conn)
+        except Exception:
+            release_db(conn)
+            raise
     return conn
 
+def release_db(conn):
+    """Returns a connection to the pool. Any open transaction is rolled back by the pool."""
+    conn.released_at = time.monotonic()
+    get_pool().putconn(conn)
+
+# --- LICENSE CACHE ---
+# Serialized get_license bodies and their ETags, keyed by (license_key, product_id). License
+# rows rarely change, so repeated polls for the same key are answered from memory.
+# TTLCache isn't thread-safe, so every access goes through the lock.
+LICENSE_CACHE = TTLCache(maxsize=10000, ttl=60)
+LICENSE_CACHE_LOCK = threading.Lock()
+
+def invalidate_cached_license(license_key, product_id):
+    """Drops a license from the response cache after its row has been modified."""
+    with LICENSE_CACHE_LOCK:
+        LICENSE_CACHE.pop((license_key, product_id), None)
+
+# Bump whenever setup_database() changes, so existing databases run it again.
+SCHEMA_VERSION = 1
+
 def setup_database():
-    """Creates the 'licenses' table if it doesn't already exist."""
-    print("Checking and setting up database table...")
+    """Creates the 'licenses' table and its indexes unless the schema is already up to date.
+    Errors are raised to the caller."""
+    log.info("Checking and setting up database table...")
+    conn = None
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # <-- CHANGE: Updated table definition to include all required fields for the future.
-        # This won't affect your existing table, which you will update with the ALTER TABLE commands.
-        cur.execute('''
-            CREATE TABLE IF NOT EXISTS licenses (
-                id SERIAL PRIMARY KEY,
-                license_key VARCHAR(255) UNIQUE NOT NULL,
-                product_id VARCHAR(255) NOT NULL,
-                status VARCHAR(50) DEFAULT 'available',
-                entity_id VARCHAR(255),
-                "numberOfSeats" INTEGER NOT NULL DEFAULT 1,
-                "exp" TIMESTAMP WITH TIME ZONE DEFAULT NULL,
-                "editions" VARCHAR(100) NOT NULL DEFAULT '{"en": "Commercial"}',
-                date_created TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
-                date_assigned TIMESTAMP WITH TIME ZONE
-            );
-        ''')
-        conn.commit()
-        cur.close()
-        conn.close()
-        print("Database table setup complete.")
-    except Exception as e:
-        print(f"FATAL: Error setting up database: {e}")
+        # Take a plain connection: the statements can't be prepared until the table exists.
+        conn = get_pool().getconn()
+        with conn, conn.cursor() as cur:
+            cur.execute("SELECT to_regclass('schema_version') IS NOT NULL;")
+            if cur.fetchone()[0]:
+                cur.execute('SELECT MAX(version) FROM schema_version;')
+                if cur.fetchone()[0] == SCHEMA_VERSION:
+                    log.info("Database schema is up to date (version %d).", SCHEMA_VERSION)
+                    return
+            # <-- CHANGE: Updated table definition to include all required fields for the future.
+            # This won't affect your existing table, which you will update with the ALTER TABLE commands.
+            cur.execute('''
+                CREATE TABLE IF NOT EXISTS licenses (
+                    id SERIAL PRIMARY KEY,
+                    license_key VARCHAR(255) UNIQUE NOT NULL,
+                    product_id VARCHAR(255) NOT NULL,
+                    status VARCHAR(50) DEFAULT 'available',
+                    entity_id VARCHAR(255),
+                    "numberOfSeats" INTEGER NOT NULL DEFAULT 1,
+                    "exp" TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+                    "editions" JSONB NOT NULL DEFAULT '{"en": "Commercial"}'::jsonb,
+                    date_created TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+                    date_assigned TIMESTAMP WITH TIME ZONE
+                );
+            ''')
+            # Tables created before "editions" became JSONB stored it as VARCHAR. Convert them once;
+            # the old text default can't be cast automatically, so it is dropped and set again.
+            cur.execute(
+                "SELECT data_type FROM information_schema.columns"
+                " WHERE table_schema = current_schema() AND table_name = 'licenses' AND column_name = 'editions';"
+            )
+            if cur.fetchone()[0] != 'jsonb':
+                log.info("Converting licenses.editions to JSONB...")
+                cur.execute('''
+                    ALTER TABLE licenses
+                        ALTER COLUMN "editions" DROP DEFAULT,
+                        ALTER COLUMN "editions" TYPE JSONB USING "editions"::jsonb,
+                        ALTER COLUMN "editions" SET DEFAULT '{"en": "Commercial"}'::jsonb;
+                ''')
+            # Every lookup filters on both key and product, so cover both in one index.
+            cur.execute('CREATE INDEX IF NOT EXISTS licenses_key_prod_idx ON licenses (license_key, product_id);')
+            # Only unassigned rows are indexed here, which keeps it small as licenses get handed out.
+            cur.execute("CREATE INDEX IF NOT EXISTS licenses_avail_idx ON licenses (product_id) WHERE status = 'available';")
+            cur.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL);')
+            cur.execute('DELETE FROM schema_version;')
+            cur.execute('INSERT INTO schema_version (version) VALUES (%s);', (SCHEMA_VERSION,))
+        log.info("Database table setup complete.")
+    finally:
+        if conn is not None:
+            release_db(conn)
+
+# --- AUTHENTICATION ---
+# Expected credentials, encoded once for constant-time comparison. Without both of them
+# configured nobody is let in, same as before.
+AUTH_CONFIGURED = ISSUER_ID is not None and ISSUER_SECRET is not None
+EXPECTED_USERNAME = (ISSUER_ID or '').encode('utf-8')
+EXPECTED_PASSWORD = (ISSUER_SECRET or '').encode('utf-8')
 
-# --- AUTHENTICATION (Unchanged) ---
 def check_auth(username, password):
-    return username == ISSUER_ID and password == ISSUER_SECRET
+    # Bitwise & so both comparisons always run and timing doesn't reveal which one failed.
+    matches = hmac.compare_digest((username or '').encode('utf-8'), EXPECTED_USERNAME) & \
+        hmac.compare_digest((password or '').encode('utf-8'), EXPECTED_PASSWORD)
+    return AUTH_CONFIGURED and matches
 
 def authenticate():
     return Response('Could not verify your access level...', 401, {'WWW-Authenticate': 'Basic realm="Login Required"'})
@@ -62,6 +261,43 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
+# --- RESPONSES ---
+def orjsonify(payload):
+    """Like jsonify, but serializes with orjson, which is several times faster than stdlib json."""
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+# Every license object has the same shape, so it is assembled from pre-encoded pieces instead
+# of building a dict for orjson to walk. The issuer never changes and is encoded once.
+ISSUER_JSON = orjson.dumps(ISSUER_ID)
+
+def license_json(license_key, product_id, exp_epoch, number_of_seats, editions):
+    """Serializes one license object in the format Cloud Zoo expects."""
+    key_json = orjson.dumps(license_key)
+    return b''.join((
+        b'{"id":', key_json,
+        b',"key":', key_json,
+        b',"aud":', orjson.dumps(product_id),
+        b',"iss":', ISSUER_JSON,
+        b',"exp":', orjson.dumps(exp_epoch),
+        b',"numberOfSeats":', orjson.dumps(number_of_seats),
+        b',"editions":', orjson.dumps(editions),
+        b'}',
+    ))
+
+def license_cluster_json(license_jsons):
+    """Wraps serialized licenses in a License Cluster object."""
+    return b''.join((b'{"licenses":[', b','.join(license_jsons), b']}'))
+
+def license_etag(body):
+    """A short content hash of a serialized license, used as its (weak) ETag."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def conditional_json_response(body, etag):
+    """Sends body with its ETag, or an empty 304 Not Modified if the client's If-None-Match matches."""
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    return response.make_conditional(request)
+
 # --- ROUTES ---
 
 @app.route("/")
@@ -76,94 +312,134 @@ def get_license():
     product_id_req = request.args.get("aud")
 
     if not license_key or not product_id_req:
-        return jsonify({"description": "Missing license key or product ID."}), 400
+        return orjsonify({"description": "Missing license key or product ID."}), 400
+
+    cache_key = (license_key, product_id_req)
+    with LICENSE_CACHE_LOCK:
+        cached = LICENSE_CACHE.get(cache_key)
+    if cached is not None:
+        log.debug("SUCCESS (get_license): Found license %s (cached)", license_key)
+        return conditional_json_response(*cached)
 
     conn = get_db_connection()
-    cur = conn.cursor()
-    # <-- CHANGE: Updated SELECT query to get the new fields from the database.
-    cur.execute(
-        'SELECT license_key, product_id, "numberOfSeats", "exp", "editions" FROM licenses WHERE license_key = %s AND product_id = %s;',
-        (license_key, product_id_req)
-    )
-    license_data = cur.fetchone()
-    cur.close()
-    conn.close()
+    try:
+        with conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            # <-- CHANGE: Updated SELECT query to get the new fields from the database.
+            cur.execute('EXECUTE get_license_v2 (%s, %s);', (license_key, product_id_req))
+            license_data = cur.fetchone()
+    finally:
+        release_db(conn)
 
     if license_data:
-        key, prod_id, number_of_seats, expiration, editions_str = license_data
-        
         # <-- CHANGE: Building the new, correctly formatted response object.
-        json_response = {
-            "id": key,
-            "key": key,
-            "aud": prod_id,
-            "iss": ISSUER_ID,
-            "exp": int(expiration.timestamp()) if expiration else None,
-            "numberOfSeats": number_of_seats,
-            "editions": json.loads(editions_str) # Parse the JSON string from the DB
-        }
+        body = license_json(
+            license_data['license_key'], license_data['product_id'], license_data['exp_epoch'],
+            license_data['numberOfSeats'], license_data['editions']
+        )
+        etag = license_etag(body)
+        with LICENSE_CACHE_LOCK:
+            LICENSE_CACHE[cache_key] = (body, etag)
         
-        print(f"SUCCESS (get_license): Found license. Returning: {json.dumps(json_response)}")
-        return jsonify(json_response), 200
+        log.debug("SUCCESS (get_license): Found license %s", license_key)
+        return conditional_json_response(body, etag)
     else:
-        print(f"INFO (get_license): No valid license found for key {license_key}")
-        return jsonify({"description": "License key not found for the specified product."}), 404
+        log.info("get_license: No valid license found for key %s", license_key)
+        return orjsonify({"description": "License key not found for the specified product."}), 404
 
 # == Route for POST /add_license ==
 @app.route("/add_license", methods=["POST"])
 @requires_auth
 def add_license():
     try:
-        data = request.get_json()
-        if not data: return jsonify({"description": "Request body is missing"}), 400
+        # silent=True: a missing or malformed body is answered below instead of raising.
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict): return orjsonify({"description": "Request body is missing"}), 400
+
+        license_cluster = data.get('licenseCluster') or {}
+        license_info = data.get('license') or {}
+        if not isinstance(license_cluster, dict) or not isinstance(license_info, dict):
+            return orjsonify({"description": "Request is missing key data or entity ID."}), 400
+
+        # A whole License Cluster can be added at once; all of its licenses are assigned or none.
+        licenses_to_add = license_cluster.get('licenses')
+        if licenses_to_add:
+            if not isinstance(licenses_to_add, list):
+                return orjsonify({"description": "Request is missing key data or entity ID."}), 400
+            return add_license_cluster(licenses_to_add, data.get('entityId'))
 
-        license_info = data.get('license', {})
         license_key, product_id, entity_id = license_info.get('key'), license_info.get('aud'), data.get('entityId')
 
-        if not all([license_key, product_id, entity_id]):
-            return jsonify({"description": "Request is missing key data or entity ID."}), 400
+        if not (license_key and product_id and entity_id) or not all(
+            isinstance(value, str) for value in (license_key, product_id, entity_id)
+        ):
+            return orjsonify({"description": "Request is missing key data or entity ID."}), 400
 
         conn = get_db_connection()
-        cur = conn.cursor()
-        # <-- CHANGE: Fetch all data needed to build the response object.
-        cur.execute(
-            'SELECT status, "numberOfSeats", "exp", "editions" FROM licenses WHERE license_key = %s AND product_id = %s;',
-            (license_key, product_id)
-        )
-        result = cur.fetchone()
-
-        if not result:
-            cur.close(), conn.close()
-            return jsonify({"description": "The provided license key does not exist."}), 409
+        try:
+            # The transaction commits (or rolls back) and the cursor closes when the block exits.
+            with conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                # Assign the license in a single statement. The row is locked before its status is
+                # checked, so two concurrent requests can't both claim the same available key.
+                cur.execute('EXECUTE assign_license_v3 (%s, %s, %s);', (entity_id, license_key, product_id))
+                result = cur.fetchone()
+        finally:
+            release_db(conn)
 
-        current_status, number_of_seats, expiration, editions_str = result
-        if current_status != 'available':
-            cur.close(), conn.close()
-            return jsonify({"description": "This license key is not available to be added."}), 409
+        if result is None:
+            return orjsonify({"description": "The provided license key does not exist."}), 409
+        if not result['assigned']:
+            log.info("add_license: %s is not available (status %s)", license_key, result['prior_status'])
+            return orjsonify({"description": "This license key is not available to be added."}), 409
 
-        # Success case: Update the database
-        cur.execute( "UPDATE licenses SET status = 'assigned', entity_id = %s, date_assigned = NOW() WHERE license_key = %s;", (entity_id, license_key))
-        conn.commit()
-        cur.close(), conn.close()
+        invalidate_cached_license(license_key, product_id)
 
         # <-- CHANGE: Building the new, correctly formatted License Cluster response.
-        license_cluster_response = {
-            "licenses": [{
-                "id": license_key,
-                "key": license_key,
-                "aud": product_id,
-                "iss": ISSUER_ID,
-                "exp": int(expiration.timestamp()) if expiration else None,
-                "numberOfSeats": number_of_seats,
-                "editions": json.loads(editions_str)
-            }]
-        }
-        print(f"SUCCESS (add_license): Assigned {license_key} to entity {entity_id}")
-        return jsonify(license_cluster_response), 200
+        license_cluster_response = license_cluster_json((
+            license_json(license_key, product_id, result['exp_epoch'], result['numberOfSeats'], result['editions']),
+        ))
+        log.info("SUCCESS (add_license): Assigned %s to entity %s", license_key, entity_id)
+        return Response(license_cluster_response, mimetype='application/json'), 200
 
     except Exception as e:
-        print(f"FATAL ERROR in /add_license: {e}")
-        return jsonify({"description": "An internal server error occurred."}), 500
+        log.exception("FATAL ERROR in /add_license: %s", e)
+        return orjsonify({"description": "An internal server error occurred."}), 500
+
+def add_license_cluster(licenses_to_add, entity_id):
+    """Assigns every license in a cluster to entity_id in a single round trip."""
+    if not (entity_id and isinstance(entity_id, str)) or not all(
+        isinstance(license_info, dict) and license_info.get('key') and license_info.get('aud')
+        and isinstance(license_info.get('key'), str) and isinstance(license_info.get('aud'), str)
+        for license_info in licenses_to_add
+    ):
+        return orjsonify({"description": "Request is missing key data or entity ID."}), 400
+    # A key listed twice is assigned once; dict.fromkeys drops repeats but keeps the order.
+    rows = list(dict.fromkeys(
+        (entity_id, license_info['key'], license_info['aud']) for license_info in licenses_to_add
+    ))
+
+    conn = get_db_connection()
+    try:
+        with conn, conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            assigned = psycopg2.extras.execute_values(cur, ASSIGN_LICENSE_CLUSTER_SQL, rows, fetch=True)
+            if len(assigned) != len(rows):
+                # Some key is missing or already taken: undo the ones that were assigned.
+                conn.rollback()
+                log.info("add_license: only %d of %d licenses in the cluster are available", len(assigned), len(rows))
+                return orjsonify({"description": "One or more license keys are not available to be added."}), 409
+    finally:
+        release_db(conn)
+
+    for _, key, product_id in rows:
+        invalidate_cached_license(key, product_id)
+
+    # Answer in the order the licenses were sent, not the order the UPDATE returned them.
+    assigned_by_key = {row['license_key']: row for row in assigned}
+    license_cluster_response = license_cluster_json(
+        license_json(row['license_key'], row['product_id'], row['exp_epoch'], row['numberOfSeats'], row['editions'])
+        for row in (assigned_by_key[key] for _, key, _ in rows)
+    )
+    log.info("SUCCESS (add_license): Assigned %d licenses to entity %s", len(rows), entity_id)
+    return Response(license_cluster_response, mimetype='application/json'), 200
         
 @app.route("/remove_license", methods=["POST"])
 @requires_auth
@@ -173,48 +449,65 @@ def remove_license():
     This is called when a user removes a license from their account.
     """
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"description": "Request body is missing"}), 400
+        data = request.get_json(silent=True)
+        if not data or not isinstance(data, dict):
+            return orjsonify({"description": "Request body is missing"}), 400
 
         # Cloud Zoo sends a LicenseCluster object when removing
-        license_cluster = data.get('licenseCluster', {})
-        licenses_to_remove = license_cluster.get('licenses', [])
+        license_cluster = data.get('licenseCluster') or {}
+        licenses_to_remove = license_cluster.get('licenses') if isinstance(license_cluster, dict) else None
 
+        if not licenses_to_remove or not isinstance(licenses_to_remove, list):
+            return orjsonify({"description": "No licenses specified for removal."}), 400
+
+        licenses_to_remove = [
+            license_info for license_info in licenses_to_remove
+            if isinstance(license_info, dict) and license_info.get('key')
+            and isinstance(license_info['key'], str) and isinstance(license_info.get('aud'), str)
+        ]
         if not licenses_to_remove:
-            return jsonify({"description": "No licenses specified for removal."}), 400
+            return orjsonify({"description": "No licenses specified for removal."}), 400
+
+        license_keys = [license_info['key'] for license_info in licenses_to_remove]
+        log.info("Received request to remove license(s) %s", license_keys)
 
-        # Process each license in the cluster (often there's only one)
+        # Release every license in the cluster (often there's only one) in a single statement.
+        # psycopg2 adapts the Python list to a PostgreSQL array.
         conn = get_db_connection()
-        cur = conn.cursor()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute('EXECUTE release_licenses_v1 (%s);', (license_keys,))
+                removed_count = cur.rowcount
+        finally:
+            release_db(conn)
 
         for license_info in licenses_to_remove:
-            license_key = license_info.get('key')
-            if license_key:
-                print(f"INFO: Received request to remove license {license_key}")
-                # Set the license back to available and clear the entity id
-                cur.execute(
-                    """
-                    UPDATE licenses 
-                    SET status = 'available', entity_id = NULL, date_assigned = NULL 
-                    WHERE license_key = %s;
-                    """,
-                    (license_key,)
-                )
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+            invalidate_cached_license(license_info['key'], license_info.get('aud'))
 
-        print(f"SUCCESS: Processed removal for {len(licenses_to_remove)} license(s).")
+        log.info("SUCCESS: Processed removal for %d license(s).", removed_count)
         # A successful response has a 200 OK status code and an empty body.
         return "", 200
 
     except Exception as e:
-        print(f"FATAL ERROR in /remove_license: {e}")
-        return jsonify({"description": "An internal server error occurred."}), 500        
+        log.exception("FATAL ERROR in /remove_license: %s", e)
+        return orjsonify({"description": "An internal server error occurred."}), 500        
         
+@app.cli.command("create-db")
+def create_db_command():
+    """Creates or upgrades the database schema."""
+    # Exit non-zero on failure, so a release phase running this stops a broken deploy.
+    try:
+        setup_database()
+    except Exception as e:
+        raise click.ClickException(f"Error setting up database: {e}")
+
 # --- Main execution point ---
-setup_database()
+# Schema setup runs once per deploy (`flask create-db`), not in every worker that imports the app.
+# Set RUN_DB_MIGRATIONS=1 to run it at startup instead.
+if os.environ.get('RUN_DB_MIGRATIONS') == '1':
+    try:
+        setup_database()
+    except Exception as e:
+        log.error("FATAL: Error setting up database: %s", e)
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8080)), threaded=True)
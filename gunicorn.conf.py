@@ -0,0 +1,13 @@
+# gunicorn.conf.py - production server settings, used by the Procfile and docker-compose.
+# Requests spend nearly all their time waiting on PostgreSQL, so each worker runs them as
+# gevent greenlets instead of OS threads, and psycopg2 is made to yield while it waits.
+workers = 2
+worker_class = "gevent"
+
+# At most one in-flight request per pooled connection: the pool (get_pool() in app.py) keeps
+# up to 20 open, and more concurrent checkouts would fail with "connection pool exhausted".
+worker_connections = 20
+
+def post_fork(server, worker):
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
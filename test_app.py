@@ -0,0 +1,154 @@
+import base64
+import os
+import unittest
+from unittest import mock
+
+import orjson
+
+os.environ.setdefault("ISSUER_ID", "test-issuer")
+os.environ.setdefault("ISSUER_SECRET", "test-secret")
+
+import app as issuer  # noqa: E402
+from app import app, ISSUER_ID, ISSUER_SECRET  # noqa: E402
+
+creds = base64.b64encode(f"{ISSUER_ID}:{ISSUER_SECRET}".encode("utf-8")).decode("utf-8")
+
+
+class AuthTests(unittest.TestCase):
+    def test_check_auth(self):
+        self.assertTrue(issuer.check_auth(ISSUER_ID, ISSUER_SECRET))
+        self.assertFalse(issuer.check_auth(ISSUER_ID, "wrong"))
+        self.assertFalse(issuer.check_auth("wrong", ISSUER_SECRET))
+        self.assertFalse(issuer.check_auth(None, None))
+
+    def test_check_auth_unconfigured(self):
+        # With no ISSUER_ID/ISSUER_SECRET set, even empty credentials must be rejected.
+        with mock.patch.multiple(
+            issuer, AUTH_CONFIGURED=False, EXPECTED_USERNAME=b"", EXPECTED_PASSWORD=b""
+        ):
+            self.assertFalse(issuer.check_auth("", ""))
+            self.assertFalse(issuer.check_auth(None, None))
+
+    def test_get_license_no_auth(self):
+        with app.test_client() as c:
+            rv = c.get("/get_license?aud=PRODUCT&key=KEY")
+            self.assertEqual(rv.status_code, 401)
+            self.assertIn("WWW-Authenticate", rv.headers)
+
+
+class ValidationTests(unittest.TestCase):
+    # Each of these is rejected before a database connection is checked out.
+    def post(self, path, **kwargs):
+        with app.test_client() as c:
+            return c.post(path, headers={"Authorization": f"Basic {creds}"}, **kwargs)
+
+    def test_add_license_malformed_json(self):
+        rv = self.post("/add_license", data="{not json", content_type="application/json")
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(rv.get_json().get("description"), "Request body is missing")
+
+    def test_add_license_non_object_body(self):
+        rv = self.post("/add_license", json=[1])
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(rv.get_json().get("description"), "Request body is missing")
+
+    def test_add_license_non_string_key(self):
+        for key in ({"a": 1}, ["a"], 5):
+            rv = self.post("/add_license", json={"entityId": "ENTITY", "license": {"key": key, "aud": "PRODUCT"}})
+            self.assertEqual(rv.status_code, 400)
+            self.assertEqual(rv.get_json().get("description"), "Request is missing key data or entity ID.")
+
+    def test_add_license_cluster_non_string_key(self):
+        payload = {
+            "entityId": "ENTITY",
+            "licenseCluster": {"licenses": [{"key": 5, "aud": "PRODUCT"}, {"key": "KEY", "aud": "PRODUCT"}]},
+        }
+        rv = self.post("/add_license", json=payload)
+        self.assertEqual(rv.status_code, 400)
+
+    def test_add_license_cluster_missing_entity_id(self):
+        rv = self.post("/add_license", json={"licenseCluster": {"licenses": [{"key": "KEY", "aud": "PRODUCT"}]}})
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(rv.get_json().get("description"), "Request is missing key data or entity ID.")
+
+    def test_remove_license_non_object_body(self):
+        rv = self.post("/remove_license", json="KEY")
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(rv.get_json().get("description"), "Request body is missing")
+
+    def test_remove_license_no_usable_keys(self):
+        licenses = [{"aud": "PRODUCT"}, {"key": {"a": 1}, "aud": "PRODUCT"}, "KEY"]
+        rv = self.post("/remove_license", json={"licenseCluster": {"licenses": licenses}})
+        self.assertEqual(rv.status_code, 400)
+        self.assertEqual(rv.get_json().get("description"), "No licenses specified for removal.")
+
+
+class LicenseJsonTests(unittest.TestCase):
+    def test_license_json(self):
+        body = issuer.license_json("KEY-\"1\"", "PRODUCT", 1546128000, 2, {"en": "Full Edition"})
+        self.assertEqual(
+            body,
+            orjson.dumps({
+                "id": "KEY-\"1\"",
+                "key": "KEY-\"1\"",
+                "aud": "PRODUCT",
+                "iss": ISSUER_ID,
+                "exp": 1546128000,
+                "numberOfSeats": 2,
+                "editions": {"en": "Full Edition"},
+            }),
+        )
+
+    def test_license_json_no_expiration(self):
+        body = issuer.license_json("KEY", "PRODUCT", None, 1, {"en": "Commercial"})
+        self.assertIsNone(orjson.loads(body)["exp"])
+
+    def test_license_cluster_json(self):
+        licenses = [issuer.license_json(k, "PRODUCT", None, 1, {}) for k in ("A", "B")]
+        cluster = orjson.loads(issuer.license_cluster_json(licenses))
+        self.assertEqual([lic["key"] for lic in cluster["licenses"]], ["A", "B"])
+
+
+class ETagTests(unittest.TestCase):
+    def setUp(self):
+        # Served from the cache, so no database is needed.
+        self.body = issuer.license_json("KEY", "PRODUCT", 1546128000, 1, {"en": "Full Edition"})
+        self.etag = issuer.license_etag(self.body)
+        with issuer.LICENSE_CACHE_LOCK:
+            issuer.LICENSE_CACHE[("KEY", "PRODUCT")] = (self.body, self.etag)
+
+    def tearDown(self):
+        with issuer.LICENSE_CACHE_LOCK:
+            issuer.LICENSE_CACHE.clear()
+
+    def test_get_license_etag(self):
+        with app.test_client() as c:
+            rv = c.get(
+                "/get_license?aud=PRODUCT&key=KEY",
+                headers={"Authorization": f"Basic {creds}"},
+            )
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.headers.get("ETag"), f'W/"{self.etag}"')
+            self.assertEqual(rv.data, self.body)
+
+    def test_get_license_not_modified(self):
+        with app.test_client() as c:
+            rv = c.get(
+                "/get_license?aud=PRODUCT&key=KEY",
+                headers={"Authorization": f"Basic {creds}", "If-None-Match": f'W/"{self.etag}"'},
+            )
+            self.assertEqual(rv.status_code, 304)
+            self.assertEqual(rv.data, b"")
+
+    def test_get_license_etag_mismatch(self):
+        with app.test_client() as c:
+            rv = c.get(
+                "/get_license?aud=PRODUCT&key=KEY",
+                headers={"Authorization": f"Basic {creds}", "If-None-Match": 'W/"stale"'},
+            )
+            self.assertEqual(rv.status_code, 200)
+            self.assertEqual(rv.data, self.body)
+
+
+if __name__ == "__main__":
+    unittest.main()